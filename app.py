@@ -1,14 +1,25 @@
 import os
 import json
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load .env before utils read their configuration (e.g. GEMINI_API_KEY)
+load_dotenv()
+
 from flask import Flask, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
-import pdfplumber
-from docx import Document
-from PIL import Image
 import io
 
-from utils.analyzer import analyze_document, calculate_risk_score
+from utils.analyzer import analyze_document, calculate_risk_score, get_client, DEFAULT_API_KEY
+from utils.extractor import (
+    extract_text, extract_pages, is_blank, MemoryMonitor, MemoryBudgetExceeded, MemoryMonitorBusy,
+    TEXT_EXTENSIONS, MEMORY_BUDGET_MB
+)
 from utils.highlighter import highlight_risky_clauses
+from utils.portfolio import get_portfolio, record_analysis, QueryError
+from utils.singleflight import singleflight, coalesce_key, file_digest, COALESCE_ENABLED
+from utils.deadline import deadline_from_request, MIN_HIGHLIGHT_SECONDS
 
 app = Flask(__name__, template_folder='.')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB limit
@@ -24,6 +35,33 @@ def internal_server_error(error):
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+DEMO_FILENAME = "Law_Contract.pdf"
+_demo_document = None
+
+
+def load_demo_document():
+    """Reads the demo contract once; returns its bytes, or None if missing."""
+    global _demo_document
+    if _demo_document is None and os.path.exists(DEMO_FILENAME):
+        with open(DEMO_FILENAME, "rb") as f:
+            _demo_document = f.read()
+    return _demo_document
+
+
+def warmup():
+    """
+    Builds shared state up front. Called from the gunicorn master when
+    preloading (see gunicorn.conf.py) so every worker inherits it
+    copy-on-write: the demo document, the Gemini SDK and the server-key
+    client. Risk dictionaries and regexes are already built at import.
+    Format libraries (pdfplumber, python-docx, PIL, PyMuPDF) stay lazy.
+    """
+    start = time.perf_counter()
+    load_demo_document()
+    if DEFAULT_API_KEY:
+        get_client(DEFAULT_API_KEY.strip())
+    print(f"[INFO] Warmup finished in {(time.perf_counter() - start) * 1000:.0f} ms")
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -37,6 +75,8 @@ def index():
 
 
 def process_upload(request):
+    # Time budget for the whole request, started before the upload is saved
+    deadline = deadline_from_request(request)
     file = request.files.get("file")
     mode = request.form.get("mode")
     provider = request.form.get("provider")
@@ -49,17 +89,13 @@ def process_upload(request):
         print(f"[DEBUG] Demo Mode Triggered. Custom Key Provided: {bool(custom_api_key)}")
         
         # Use simple filenames for demo
-        demo_filename = "Law_Contract.pdf"
+        demo_filename = DEMO_FILENAME
+        demo_bytes = load_demo_document()
         
-        if not os.path.exists(demo_filename):
+        if demo_bytes is None:
              print(f"[ERROR] Demo file missing: {demo_filename}")
              return jsonify({"error": "Demo file not found on server."}), 500
         
-        # Copy to uploads just to keep logic consistent
-        import shutil
-        filepath = os.path.join(UPLOAD_FOLDER, demo_filename)
-        shutil.copy(demo_filename, filepath)
-        
         # LOGIC:
         # If user provides a key, we use "free" mode (which uses custom_api_key)
         # If NOT, we use "premium" mode (which uses server key)
@@ -76,66 +112,107 @@ def process_upload(request):
             model_name = "gemini-flash-lite-latest" 
         
         # Bypass "if not file:" check
+        # Written to uploads from the cached bytes to keep logic consistent
         class DummyFile:
             filename = demo_filename
-            def save(self, path): pass 
+            def save(self, path):
+                with open(path, "wb") as f:
+                    f.write(demo_bytes)
         
         file = DummyFile()
 
     if not file:
         return jsonify({"error": "No file uploaded."}), 400
 
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
+    # Unique name on disk so concurrent uploads of the same file don't clobber each other
+    filepath = os.path.join(UPLOAD_FOLDER, uuid.uuid4().hex + os.path.splitext(file.filename)[1])
     file.save(filepath)
 
+    def run():
+        return analyze_upload(filepath, file.filename, mode, provider, model_name, custom_api_key, confirm_fallback, deadline)
+
+    try:
+        if COALESCE_ENABLED:
+            # Identical concurrent uploads share one extraction + AI call
+            key = coalesce_key(file_digest(filepath), mode, provider, model_name, custom_api_key, confirm_fallback)
+            # Wait at most half the budget so a follower can still do the work itself
+            (response_data, status), coalesced = singleflight.do(
+                key, run, timeout=deadline.remaining() / 2, shareable=is_shareable
+            )
+            if coalesced:
+                print(f"[INFO] Coalesced duplicate analysis of {file.filename}")
+        else:
+            response_data, status = run()
+        return jsonify(response_data), status
+
+    finally:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+
+def is_shareable(result):
+    """
+    Coalesced requests only reuse complete results: not ones degraded by the
+    leader's (possibly shorter) deadline, and not transient server errors.
+    """
+    response_data, status = result
+    return status < 500 and not response_data.get("deadline", {}).get("degraded")
+
+
+def analyze_upload(filepath, filename, mode, provider, model_name, custom_api_key, confirm_fallback, deadline=None):
+    """
+    Extracts, scores, highlights and analyzes a saved upload.
+    Returns (response_data, status_code); the result is JSON-serializable so
+    coalesced requests in other workers can reuse it.
+    """
     text = ""
     image_parts = None
+    monitor = None
 
     try:
+        # Memory-bounded mode: stream pages into a spool and track peak memory
+        if MEMORY_BUDGET_MB > 0:
+            monitor = MemoryMonitor(MEMORY_BUDGET_MB).start()
+
         ext = filepath.lower()
         highlighted_pdf_path = None
         risk_data = None
 
         # -------- PDF --------
         if ext.endswith(".pdf"):
-            with pdfplumber.open(filepath) as pdf:
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
+            text = read_document(filepath, monitor, deadline)
             
             # 1. Calculate Risk FIRST (we need flags)
             risk_data = calculate_risk_score(text)
             
-            # 2. Highlight PDF if risk found
-            if risk_data and risk_data['flags']:
+            # 2. Highlight PDF if risk found (and there's time for it)
+            if risk_data and risk_data['flags'] and deadline and not deadline.allows(MIN_HIGHLIGHT_SECONDS):
+                deadline.cut("highlighting")
+            elif risk_data and risk_data['flags']:
                 # Pass input PDF and risk flags to highlighter
-                output_name = f"highlighted_{file.filename}"
+                output_name = f"highlighted_{filename}"
                 output_path = os.path.join(UPLOAD_FOLDER, output_name)
                 
-                highlighter_result = highlight_risky_clauses(filepath, risk_data['flags'], output_path)
+                highlighter_result = highlight_risky_clauses(filepath, risk_data['flags'], output_path, deadline)
                 
                 if highlighter_result:
                     highlighted_pdf_path = output_name  # Just the filename for the URL
 
-        # -------- WORD DOC (DOCX) --------
-        elif ext.endswith(".docx"):
-            doc = Document(filepath)
-            text = "\n".join([para.text for para in doc.paragraphs])
-
-        # -------- TEXT --------
-        elif ext.endswith(".txt"):
-            with open(filepath, "r", encoding="utf-8") as f:
-                text = f.read()
+        # -------- WORD DOC (DOCX) / TEXT --------
+        elif ext.endswith(TEXT_EXTENSIONS):
+            text = read_document(filepath, monitor, deadline)
 
         # -------- IMAGES (OCR) --------
         elif ext.endswith((".jpg", ".jpeg", ".png", ".webp")):
+            from PIL import Image  # Lazy: only image uploads need Pillow
             image_parts = Image.open(filepath)
             text = "" # Text will be extracted by Gemini
             
         else:
-            return jsonify({"error": "Unsupported file format. Upload PDF, DOCX, TXT, or Image."}), 400
+            return {"error": "Unsupported file format. Upload PDF, DOCX, TXT, or Image."}, 400
 
-        if not image_parts and len(text.strip()) == 0:
-            return jsonify({"error": "No readable text found in document."}), 400
+        if not image_parts and is_blank(text):
+            return {"error": "No readable text found in document."}, 400
         
         # If we didn't calculate risk (non-PDF or image), do it now
         if not risk_data:
@@ -149,9 +226,18 @@ def process_upload(request):
             provider=provider,
             model_name=model_name,
             custom_api_key=custom_api_key,
-            confirm_fallback=confirm_fallback
+            confirm_fallback=confirm_fallback,
+            deadline=deadline
         )
             
+        # Opt-in portfolio index (no-op unless PORTFOLIO_INDEX_PATH is set).
+        # Skipped when no analysis ran (e.g. waiting for fallback confirmation)
+        # and when the deadline truncated extraction: records are permanent
+        # and keyed by the text's hash, so a partial one would never be replaced.
+        extraction_cut = deadline is not None and "extraction" in deadline.cut_stages
+        if not extraction_cut and not (isinstance(analysis_result, dict) and "status" in analysis_result):
+            record_analysis(filename, text, risk_data)
+
         # If we have a highlighted PDF, include the link
         response_data = {
             "result": analysis_result,
@@ -159,19 +245,42 @@ def process_upload(request):
             "highlighted_pdf": highlighted_pdf_path
         }
 
+        # Which stages were skipped or truncated to meet the deadline
+        if deadline:
+            response_data["deadline"] = deadline.report()
+
+        if monitor:
+            response_data["memory"] = monitor.stop()
+            response_data["memory"]["spilled_to_disk"] = getattr(text, "spilled", False)
+            print(f"[INFO] Peak memory for {filename}: {response_data['memory']['peak_mb']} MB")
+
         # Fix: Propagate status to top level for frontend handling
         if isinstance(analysis_result, dict) and "status" in analysis_result:
             response_data["status"] = analysis_result["status"]
             
-        return jsonify(response_data)
+        return response_data, 200
+
 
+    except MemoryBudgetExceeded as e:
+        print(f"[WARNING] {filename}: {e}")
+        return {"error": f"Document too large to process: {e}"}, 413
+
+    except MemoryMonitorBusy as e:
+        # Memory budgets need one request per worker (see gunicorn.conf.py)
+        print(f"[WARNING] {filename}: {e}")
+        return {"error": "Server busy, please retry."}, 503
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+        return {"error": f"Error processing file: {str(e)}"}, 500
     
     finally:
+        if monitor:
+            monitor.stop()
+        if hasattr(text, "close"):
+            text.close()  # Page spool (memory-bounded mode)
+
         # For images, we might need to keep them open if Gemini streams, but here we wait for response
         # so it's safe to delete. 
         # Note: PIL.Image.open is lazy, but we passed it to Gemini which consumes it.
@@ -179,10 +288,12 @@ def process_upload(request):
         if image_parts:
              image_parts.close()
 
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            
 
+def read_document(filepath, monitor=None, deadline=None):
+    """Whole-string extraction normally; a page spool in memory-bounded mode."""
+    if monitor:
+        return extract_pages(filepath, monitor, deadline=deadline)
+    return extract_text(filepath, deadline)
 
 
 @app.route("/api/analyze", methods=["POST"])
@@ -190,6 +301,40 @@ def api_analyze():
     return process_upload(request)
 
 
+@app.route("/api/portfolio/query", methods=["GET"])
+def portfolio_query():
+    portfolio = get_portfolio()
+    if portfolio is None:
+        return jsonify({"error": "Portfolio index is disabled. Set PORTFOLIO_INDEX_PATH to enable it."}), 404
+
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1."}), 400
+
+    start = time.perf_counter()
+    try:
+        result = portfolio.query(
+            expr=request.args.get("q"),
+            date_from=request.args.get("date_from"),
+            date_to=request.args.get("date_to"),
+            party=request.args.get("party"),
+            limit=limit
+        )
+    except QueryError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return jsonify(result)
+
+
+@app.route("/api/coalescing/stats", methods=["GET"])
+def coalescing_stats():
+    return jsonify({"enabled": COALESCE_ENABLED, **singleflight.snapshot()})
+
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
@@ -0,0 +1,27 @@
+# Gunicorn settings shared by start.sh and the Procfile.
+import gc
+import os
+
+# Import the app once in the master and fork workers from it, so imports,
+# risk dictionaries, compiled regexes, the demo document and the Gemini
+# client pool are shared copy-on-write instead of rebuilt per worker.
+preload_app = True
+# Keep above REQUEST_DEADLINE_SECONDS so requests degrade before being killed
+timeout = 120
+
+
+def on_starting(server):
+    # The extraction memory budget is measured process-wide (tracemalloc),
+    # which is only per request when each worker serves one request at a time
+    if int(os.getenv("EXTRACTION_MEMORY_BUDGET_MB", "0")) > 0 and \
+            (server.cfg.threads > 1 or server.cfg.worker_class_str != "sync"):
+        raise RuntimeError("EXTRACTION_MEMORY_BUDGET_MB needs sync workers with threads = 1.")
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded, before workers fork
+    from app import warmup
+    warmup()
+    # Move everything built so far out of the GC's reach; otherwise the first
+    # collection in each worker touches (and un-shares) those pages.
+    gc.freeze()
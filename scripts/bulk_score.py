@@ -0,0 +1,336 @@
+"""
+Offline bulk scoring for a directory or archive of contracts.
+
+Runs calculate_risk_score + rule_based_analysis over every PDF/DOCX/TXT in a
+process pool and streams one result per document to JSONL or CSV.
+
+Usage:
+    python scripts/bulk_score.py contracts/ -o results.jsonl
+    python scripts/bulk_score.py contracts.zip -o results.csv --highlight-dir highlighted/
+    python scripts/bulk_score.py contracts/ -o results.jsonl --resume
+"""
+import os
+import sys
+import csv
+import json
+import time
+import tarfile
+import zipfile
+import argparse
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# Add parent directory to path to find utils
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.analyzer import calculate_risk_score
+from utils.extractor import extract_text, TEXT_EXTENSIONS
+from utils.highlighter import highlight_risky_clauses
+from utils.rule_based import rule_based_analysis, extract_entities
+
+CSV_FIELDS = ["source", "status", "error", "chars", "score", "level", "flags",
+              "parties", "dates", "amounts", "highlighted_pdf", "seconds"]
+
+
+# ---------------- INPUT ----------------
+def list_sources(input_path):
+    """Returns the supported documents in a directory or archive, in a stable order."""
+    if os.path.isdir(input_path):
+        sources = []
+        for root, _, files in os.walk(input_path):
+            for name in files:
+                if name.lower().endswith(TEXT_EXTENSIONS):
+                    sources.append(os.path.join(root, name))
+        return sorted(sources)
+
+    if zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as zf:
+            return sorted(n for n in zf.namelist() if n.lower().endswith(TEXT_EXTENSIONS))
+
+    if tarfile.is_tarfile(input_path):
+        with tarfile.open(input_path) as tf:
+            return sorted(m.name for m in tf.getmembers()
+                          if m.isfile() and m.name.lower().endswith(TEXT_EXTENSIONS))
+
+    raise ValueError(f"{input_path} is not a directory, zip or tar archive.")
+
+
+def iter_tasks(input_path, sources):
+    """
+    Yields (source, path, data) per document. Directory entries are passed to
+    workers by path; archive members are read one at a time and passed as bytes.
+    """
+    if os.path.isdir(input_path):
+        for source in sources:
+            yield source, source, None
+    elif zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as zf:
+            for source in sources:
+                yield source, None, zf.read(source)
+    else:
+        # Walk members in archive order: looking each one up by name would
+        # rescan (and for compressed tars re-decompress) from the start
+        wanted = set(sources)
+        with tarfile.open(input_path) as tf:
+            for member in tf:
+                if member.isfile() and member.name in wanted:
+                    wanted.discard(member.name)
+                    yield member.name, None, tf.extractfile(member).read()
+
+
+# ---------------- WORKER ----------------
+def score_document(source, path, data, highlight_dir=None):
+    """Extracts, scores and rule-analyzes one document. Runs in a worker process."""
+    start = time.time()
+    result = {"source": source, "status": "ok"}
+    tmp_path = None
+
+    try:
+        if data is not None:
+            # Archive member: extractors and the highlighter want a real file
+            suffix = os.path.splitext(source)[1].lower()
+            fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            path = tmp_path
+
+        text = extract_text(path) or ""
+        result["chars"] = len(text)
+
+        if not text.strip():
+            result["status"] = "empty"
+            return result
+
+        risk_data = calculate_risk_score(text)
+        entities = extract_entities(text)
+        result.update({
+            "score": risk_data["score"],
+            "level": risk_data["level"],
+            "flags": risk_data["flags"],
+            "parties": [f"{p1} & {p2}" for p1, p2 in entities["parties"]],
+            "dates": entities["dates"],
+            "amounts": entities["money"],
+            "rule_based": rule_based_analysis(text)
+        })
+
+        if highlight_dir and source.lower().endswith(".pdf") and risk_data["flags"]:
+            safe_name = source.strip("/").replace("/", "__").replace("\\", "__")
+            output_path = os.path.join(highlight_dir, f"highlighted_{safe_name}")
+            result["highlighted_pdf"] = highlight_risky_clauses(path, risk_data["flags"], output_path)
+
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        result["seconds"] = round(time.time() - start, 3)
+
+    return result
+
+
+# ---------------- OUTPUT ----------------
+def drop_partial_line(output_path):
+    """Truncates an interrupted run's output to its last complete line."""
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # Scan back from the end in blocks rather than reading the whole file
+        while end > 0:
+            start = max(end - 64 * 1024, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            print(f"[WARNING] Dropping a partial last line from {output_path}.", file=sys.stderr)
+            f.truncate(end)
+
+
+def load_done(output_path, fmt):
+    """Sources already present in an existing output file (for --resume)."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                done.add(row["source"])
+        else:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["source"])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+class ResultWriter:
+    def __init__(self, output_path, fmt, append):
+        self.fmt = fmt
+        write_header = not (append and os.path.exists(output_path) and os.path.getsize(output_path))
+        self.f = open(output_path, "a" if append else "w", encoding="utf-8", newline="")
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, result):
+        if self.fmt == "csv":
+            row = dict(result)
+            for key in ("flags", "parties", "dates", "amounts"):
+                if key in row:
+                    row[key] = "; ".join(row[key])
+            self.writer.writerow(row)
+        else:
+            self.f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        # Flush every result so an interrupted run can be resumed
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+# ---------------- MAIN ----------------
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def run(args):
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    workers = args.workers or os.cpu_count() or 1
+
+    sources = list_sources(args.input)
+    if args.resume:
+        drop_partial_line(args.output)
+    done = load_done(args.output, fmt) if args.resume else set()
+    pending = [s for s in sources if s not in done]
+    total = len(pending)
+
+    print(f"[INFO] {len(sources)} documents found, {len(done & set(sources))} already done, "
+          f"{total} to process with {workers} workers.", file=sys.stderr)
+    if not total:
+        return 0
+
+    if args.highlight_dir:
+        os.makedirs(args.highlight_dir, exist_ok=True)
+
+    writer = ResultWriter(args.output, fmt, append=args.resume)
+    tasks = iter_tasks(args.input, pending)
+    # Bound in-flight work so only a few documents per worker are in memory
+    max_in_flight = workers * 2
+    completed = failed = 0
+    start = time.time()
+
+    def record(result):
+        nonlocal completed, failed
+        writer.write(result)
+        completed += 1
+        if result["status"] == "error":
+            failed += 1
+            print(f"[WARNING] {result['source']}: {result['error']}", file=sys.stderr)
+
+        if completed % args.progress_every == 0 or completed == total:
+            elapsed = time.time() - start
+            rate = completed / elapsed if elapsed else 0
+            eta = (total - completed) / rate if rate else 0
+            print(f"[PROGRESS] {completed}/{total} ({rate:.1f} docs/s, "
+                  f"{failed} errors, ETA {eta:.0f}s)", file=sys.stderr)
+
+    def crashed(source):
+        record({"source": source, "status": "error",
+                "error": "BrokenProcessPool: worker process died while scoring"})
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        in_flight = {}  # future -> (task, isolated)
+        # Tasks caught in a worker crash. They are rerun one at a time, so a
+        # second crash pins down the document that causes it.
+        retry = deque()
+        exhausted = False
+        while in_flight or retry or not exhausted:
+            broken = False
+            task = None
+            try:
+                if retry:
+                    if not in_flight:
+                        task = retry.popleft()
+                        in_flight[pool.submit(score_document, *task, args.highlight_dir)] = (task, True)
+                        task = None
+                else:
+                    while not exhausted and len(in_flight) < max_in_flight:
+                        try:
+                            task = next(tasks)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        in_flight[pool.submit(score_document, *task, args.highlight_dir)] = (task, False)
+                        task = None
+            except BrokenProcessPool:
+                # The pool broke after the last wait(); the task never started
+                broken = True
+                retry.appendleft(task)
+
+            if not broken and in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        continue
+                    in_flight.pop(future)
+                    record(result)
+
+            if broken:
+                # A worker died (segfault, OOM kill) and took the pool with it
+                print("[WARNING] A worker process died; restarting the pool.", file=sys.stderr)
+                wait(in_flight)
+                for future, (task, isolated) in in_flight.items():
+                    try:
+                        record(future.result())
+                    except BrokenProcessPool:
+                        if isolated:
+                            crashed(task[0])  # It was running alone: this is the culprit
+                        else:
+                            retry.append(task)
+                in_flight = {}
+                pool.shutdown(wait=True)
+                pool = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        pool.shutdown(wait=True)
+        writer.close()
+
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk risk-score a directory or archive of contracts.")
+    parser.add_argument("input", help="Directory, .zip or .tar(.gz) of PDF/DOCX/TXT contracts")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Override format detection from the output extension")
+    parser.add_argument("-w", "--workers", type=positive_int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--highlight-dir", help="Write highlighted PDFs into this directory")
+    parser.add_argument("--resume", action="store_true", help="Skip documents already in the output file and append")
+    parser.add_argument("--progress-every", type=positive_int, default=25, help="Report progress every N documents")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(run(args))
+    except ValueError as e:
+        print(f"❌ ERROR: {e}", file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
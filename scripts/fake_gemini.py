@@ -0,0 +1,195 @@
+"""
+Local stand-in for the Gemini REST API, for exercising the app offline.
+
+Implements just what ContractClarity uses: generateContent and the
+cachedContents create/get/delete calls, with server-side TTL expiry and
+switches to mimic models without caching support or cache size minimums.
+
+Usage:
+    python scripts/fake_gemini.py --port 8765 --no-cache-models gemini-2.0-flash-lite
+    GEMINI_API_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=test python app.py
+
+GET /stats shows how many calls and input characters each path received.
+"""
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+caches = {}
+stats = {"generate": 0, "generate_cached": 0, "caches_created": 0, "cache_misses": 0, "input_chars": 0}
+lock = threading.Lock()
+options = None
+
+
+def text_of(value):
+    """Concatenates all text parts in a Content / list of Contents / string."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "".join(text_of(v) for v in value)
+    if "parts" in value:
+        return "".join(p.get("text", "") for p in value["parts"])
+    return value.get("text", "")
+
+
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, code, status, message):
+        self._send(code, {"error": {"code": code, "status": status, "message": message}})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _cache(self, cache_id):
+        with lock:
+            cache = caches.get(cache_id)
+            if cache and cache["expires_at"] <= time.time():
+                del caches[cache_id]
+                cache = None
+        return cache
+
+    def log_message(self, fmt, *args):
+        if not options.quiet:
+            super().log_message(fmt, *args)
+
+    # ---------------- ROUTES ----------------
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with lock:
+                return self._send(200, {**stats, "live_caches": len(caches)})
+        m = re.search(r"/cachedContents/([^/?]+)", self.path)
+        if m:
+            cache = self._cache(m.group(1))
+            if not cache:
+                return self._error(404, "NOT_FOUND", "CachedContent not found (or permission denied)")
+            return self._send(200, cache["resource"])
+        self._error(404, "NOT_FOUND", f"Unknown path {self.path}")
+
+    def do_DELETE(self):
+        m = re.search(r"/cachedContents/([^/?]+)", self.path)
+        if m:
+            with lock:
+                caches.pop(m.group(1), None)
+            return self._send(200, {})
+        self._error(404, "NOT_FOUND", f"Unknown path {self.path}")
+
+    def do_POST(self):
+        body = self._body()
+        if re.search(r"/cachedContents/?(\?|$)", self.path):
+            return self.create_cache(body)
+        m = re.search(r"/models/([^/:]+):generateContent", self.path)
+        if m:
+            return self.generate(m.group(1), body)
+        self._error(404, "NOT_FOUND", f"Unknown path {self.path}")
+
+    def create_cache(self, body):
+        model = body.get("model", "").split("/")[-1]
+        if model in options.no_cache_models:
+            return self._error(400, "INVALID_ARGUMENT", f"Model {model} is not supported for createCachedContent.")
+
+        cached_text = text_of(body.get("systemInstruction")) + text_of(body.get("contents"))
+        tokens = len(cached_text) // 4
+        if tokens < options.min_cache_tokens:
+            return self._error(400, "INVALID_ARGUMENT",
+                               f"Cached content is too small. total_token_count={tokens}, "
+                               f"min_total_token_count={options.min_cache_tokens}")
+
+        ttl = float(str(body.get("ttl", f"{options.default_ttl}s")).rstrip("s"))
+        ttl = min(ttl, options.max_ttl) if options.max_ttl else ttl
+        cache_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        resource = {
+            "name": f"cachedContents/{cache_id}",
+            "model": f"models/{model}",
+            "displayName": body.get("displayName", ""),
+            "createTime": rfc3339(now),
+            "updateTime": rfc3339(now),
+            "expireTime": rfc3339(now + ttl),
+            "usageMetadata": {"totalTokenCount": tokens}
+        }
+        with lock:
+            caches[cache_id] = {"resource": resource, "text": cached_text, "model": model, "expires_at": now + ttl}
+            stats["caches_created"] += 1
+        self._send(200, resource)
+
+    def generate(self, model, body):
+        if model in options.unavailable_models:
+            return self._error(503, "UNAVAILABLE", "The model is overloaded. Please try again later.")
+
+        prompt_text = text_of(body.get("contents"))
+        cached_tokens = 0
+        cached_name = body.get("cachedContent")
+        if cached_name:
+            cache = self._cache(cached_name.split("/")[-1])
+            if not cache:
+                with lock:
+                    stats["cache_misses"] += 1
+                return self._error(404, "NOT_FOUND", "CachedContent not found (or permission denied)")
+            cached_tokens = len(cache["text"]) // 4
+
+        with lock:
+            stats["generate"] += 1
+            stats["generate_cached"] += bool(cached_name)
+            stats["input_chars"] += len(prompt_text)
+
+        prompt_tokens = len(prompt_text) // 4 + cached_tokens
+        answer = (
+            "📄 **Executive Summary**\n"
+            f"Stand-in response from {model} ({len(prompt_text)} prompt chars sent, "
+            f"{'cache ' + cached_name if cached_name else 'no cache'}).\n"
+        )
+        self._send(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": answer}]},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "cachedContentTokenCount": cached_tokens,
+                "candidatesTokenCount": len(answer) // 4,
+                "totalTokenCount": prompt_tokens + len(answer) // 4
+            },
+            "modelVersion": model
+        })
+
+
+def main():
+    global options
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-cache-models", nargs="*", default=[], help="Models that reject context caching")
+    parser.add_argument("--unavailable-models", nargs="*", default=[], help="Models that always return 503")
+    parser.add_argument("--min-cache-tokens", type=int, default=0, help="Reject caches smaller than this (~4 chars/token)")
+    parser.add_argument("--default-ttl", type=float, default=3600)
+    parser.add_argument("--max-ttl", type=float, default=0, help="Clamp cache TTLs (seconds) to test expiry")
+    parser.add_argument("--quiet", action="store_true")
+    options = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", options.port), Handler)
+    print(f"🧪 Fake Gemini API listening on http://127.0.0.1:{options.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
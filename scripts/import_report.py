@@ -0,0 +1,76 @@
+"""
+Measures cold-start cost of the web entry point.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and prints
+the slowest imports by cumulative time, then times warmup() separately.
+
+Usage:
+    python scripts/import_report.py [--top 20]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(statement):
+    """Returns [(cumulative_us, self_us, module)] from -X importtime output."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        raise SystemExit(f"❌ ERROR: `{statement}` failed.")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+        # Drop the separator space; remaining indentation marks nesting depth
+        rows.append((int(cumulative_us), int(self_us), module[1:].rstrip()))
+    return rows
+
+
+def timed(statement):
+    """Wall-clock seconds for a statement in a fresh interpreter (incl. startup)."""
+    code = f"import time; s = time.perf_counter(); {statement}; print(time.perf_counter() - s)"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        raise SystemExit(f"❌ ERROR: `{statement}` failed.")
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time report for app.py")
+    parser.add_argument("--top", type=int, default=20, help="How many imports to list")
+    args = parser.parse_args()
+
+    rows = import_times("import app")
+    # Top-level entries (no indentation) add up to the total import cost
+    total_us = sum(cum for cum, _, module in rows if not module.startswith(" "))
+
+    print(f"📦 import app: {total_us / 1000:.1f} ms across {len(rows)} modules\n")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cum, self_us, module in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cum / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {module.strip()}")
+
+    print()
+    print(f"⏱️  import app:            {timed('import app') * 1000:.0f} ms")
+    print(f"⏱️  import app + warmup(): {timed('import app; app.warmup()') * 1000:.0f} ms")
+
+    lazy = ["pdfplumber", "docx", "PIL", "fitz"]
+    loaded = {module.strip().split(".")[0] for _, _, module in rows}
+    eager = [m for m in lazy if m in loaded]
+    if eager:
+        print(f"\n⚠️  Format libraries imported at startup: {', '.join(eager)}")
+    else:
+        print("\n✅ Format libraries (pdfplumber, docx, PIL, fitz) are imported lazily.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 #!/bin/bash
-python3 -m gunicorn -b 127.0.0.1:8000 --timeout 120 app:app
+python3 -m gunicorn -c gunicorn.conf.py -b 127.0.0.1:8000 app:app
@@ -1,21 +1,51 @@
 import os
-from google import genai
-from google.api_core import exceptions
-from dotenv import load_dotenv
 import threading
 import time
+from collections import OrderedDict
 from .rule_based import rule_based_analysis
+from .prompt_cache import prompt_cache, CONTEXT_CACHE_ENABLED
+from .deadline import DeadlineExceeded, MIN_AI_ATTEMPT_SECONDS
 
-load_dotenv()
-
-# Your premium server key (from .env)
+# Your premium server key (from .env, loaded by the entry point before import)
 DEFAULT_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Optional API endpoint override, e.g. a local stand-in for testing
+GEMINI_API_BASE_URL = os.getenv("GEMINI_API_BASE_URL")
+
 # Lock to prevent race conditions with global API key configuration
 api_lock = threading.Lock()
 
+# Client pool: one genai.Client per API key, so clients (and the SDK import)
+# are built once — in the gunicorn master when preloading — not per request.
+MAX_POOLED_CLIENTS = 32
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key):
+    """Returns a pooled genai.Client for the key, creating it on first use."""
+    # Imported lazily: google.genai is the slowest import in the app
+    from google import genai
+    from google.genai import types
+
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            if GEMINI_API_BASE_URL:
+                # Point the SDK at a local stand-in (see scripts/fake_gemini.py)
+                client = genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=GEMINI_API_BASE_URL))
+            else:
+                client = genai.Client(api_key=api_key)
+            _clients[api_key] = client
+            # Bound the pool; user-supplied keys come and go
+            while len(_clients) > MAX_POOLED_CLIENTS:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(api_key)
+        return client
+
 
-def analyze_document(text, image_parts=None, mode="free", provider="gemini", model_name="gemini-1.5-flash", custom_api_key=None, confirm_fallback=False):
+def analyze_document(text, image_parts=None, mode="free", provider="gemini", model_name="gemini-1.5-flash", custom_api_key=None, confirm_fallback=False, deadline=None):
     
     api_key = None
     model_to_use = model_name
@@ -70,16 +100,13 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
                 masked_key = f"{api_key[:4]}...{api_key[-4:]}" if len(api_key) > 8 else "****"
                 print(f"[DEBUG] Using API Key: {masked_key}")
 
-            # New SDK Client Initialization
-            client = genai.Client(api_key=api_key)
-
-            prompt = structured_prompt(text)
+            # New SDK Client (pooled per key)
+            client = get_client(api_key)
 
-            # Prepare contents
-            contents = []
-            if image_parts:
-                contents.append(image_parts)
-            contents.append(prompt)
+            # Documents analyzed before can have their own context cache.
+            # Not images: their text is a fixed placeholder, not the document.
+            repeat = CONTEXT_CACHE_ENABLED and not image_parts and \
+                prompt_cache.note_document(document_prompt(text))
 
             # Fallback Strategy for High Availability
             # 1. Primary: Requested model (usually gemini-flash-lite-latest)
@@ -99,6 +126,11 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
             last_error = None
             
             for current_model in models_to_try:
+                # Don't start attempts that can't finish before the deadline
+                if deadline and not deadline.allows(MIN_AI_ATTEMPT_SECONDS):
+                    deadline.cut("ai_analysis")
+                    break
+
                 print(f"[INFO] Attempting to generate with model: {current_model}")
                 
                 # Retry logic PER MODEL
@@ -107,10 +139,7 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
                 
                 for attempt in range(max_retries):
                     try:
-                        response = client.models.generate_content(
-                            model=current_model,
-                            contents=contents
-                        )
+                        response = generate(client, api_key, current_model, text, image_parts, repeat, deadline)
                         success = True
                         break # Break retry loop
                     except Exception as e:
@@ -119,6 +148,9 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
                         # Check for 503 (Service Unavailable) OR 429 (Rate Limit / Resource Exhausted)
                         if "503" in error_str or "ServiceUnavailable" in error_str or "server_error" in error_str or "429" in error_str or "ResourceExhausted" in error_str:
                             if attempt < max_retries - 1:
+                                if deadline and not deadline.allows(retry_delay + MIN_AI_ATTEMPT_SECONDS):
+                                    print(f"[WARNING] Model {current_model} Error (503/429). No time left to retry.")
+                                    break
                                 print(f"[WARNING] Model {current_model} Error (503/429). Retrying in {retry_delay}s...")
                                 time.sleep(retry_delay)
                                 retry_delay *= 2
@@ -131,6 +163,9 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
                     break # Break model loop
             
             if not success:
+                if deadline and not deadline.allows(MIN_AI_ATTEMPT_SECONDS):
+                    deadline.cut("ai_analysis")
+                    raise DeadlineExceeded("No time left for AI analysis.")
                 raise last_error # Re-raise the last error if all models/retries failed
 
         # --- RISK SCORING ALGORITHM ---
@@ -158,6 +193,11 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
         risk_data = calculate_risk_score(text) if text else {'score': 0, 'level': 'Unknown', 'flags': []}
         fallback_header = f"**Risk Score:** {risk_data['score']}/100 ({risk_data['level']})\n\n"
 
+        # Out of time: answer with the rule-based analysis instead
+        if isinstance(e, DeadlineExceeded):
+             print(f"\n[WARNING] Deadline reached before AI analysis finished: {e}", file=sys.stderr)
+             return f"⏱️ **Time Limit Reached:** The AI analysis could not finish in time. Showing basic analysis.\n\n{fallback_header}" + (rule_based_analysis(text) if not image_parts else " (OCR unavailable without AI)")
+
         # Check for Rate Limit (429)
         error_str = str(e)
         if "429" in error_str or "ResourceExhausted" in error_str:
@@ -169,59 +209,143 @@ def analyze_document(text, image_parts=None, mode="free", provider="gemini", mod
         return f"AI Error: {type(e).__name__}: {str(e)} \n\n{fallback_header}Fallback Analysis:\n" + (rule_based_analysis(text) if not image_parts else " (OCR unavailable due to error)")
 
 
+def build_request(text, image_parts=None, cache_name=None, cached_document=False, deadline=None):
+    """
+    Returns (contents, config) for generate_content. With a context cache the
+    cached prefix is referenced by name and only the rest is sent. With a
+    deadline the HTTP timeout is capped at the time left.
+    """
+    contents = []
+    if image_parts:
+        contents.append(image_parts)
+
+    if not cache_name:
+        contents.append(structured_prompt(text))
+    else:
+        contents.append(CACHED_DOCUMENT_PROMPT if cached_document else document_prompt(text))
+
+    if not cache_name and not deadline:
+        return contents, None
+
+    from google.genai import types
+
+    return contents, types.GenerateContentConfig(
+        cached_content=cache_name,
+        http_options=types.HttpOptions(timeout=deadline.timeout_ms()) if deadline else None
+    )
+
+
+def generate(client, api_key, model, text, image_parts=None, repeat=False, deadline=None):
+    """
+    One generate_content call, using a context cache when the model supports
+    it. If the cache has expired server-side it is recreated once.
+    """
+    cache_name, cached_document = None, False
+    if CONTEXT_CACHE_ENABLED:
+        cache_name, cached_document = prompt_cache.prepare(
+            client, api_key, model, INSTRUCTION_PROMPT, document_prompt(text), repeat, deadline
+        )
+
+    contents, config = build_request(text, image_parts, cache_name, cached_document, deadline)
+    try:
+        return client.models.generate_content(model=model, contents=contents, config=config)
+    except Exception as e:
+        if not cache_name or not prompt_cache.is_missing_cache_error(e):
+            raise
+        print(f"[WARNING] Context cache {cache_name} expired; recreating.")
+        prompt_cache.invalidate(api_key, model, cache_name)
+        cache_name, cached_document = prompt_cache.prepare(
+            client, api_key, model, INSTRUCTION_PROMPT, document_prompt(text), repeat, deadline
+        )
+        contents, config = build_request(text, image_parts, cache_name, cached_document, deadline)
+        return client.models.generate_content(model=model, contents=contents, config=config)
+
+
+# Risk Categories & Weights
+# High Impact (30 pts) -> Immediate Deal-Breakers
+HIGH_RISKS = {
+    "termination without cause": 30,
+    "termination for convenience": 30,
+    "indemnify": 25,
+    "indemnification": 25,
+    "unlimited liability": 30,
+    "liquidated damages": 25,
+    "automatic renewal": 25,
+    "auto-renewal": 25
+}
+
+# Medium Impact (15 pts) -> Standard but risky
+MEDIUM_RISKS = {
+    "arbitration": 15,
+    "exclusive jurisdiction": 15,
+    "non-compete": 15,
+    "exclusivity": 15,
+    "penalty": 15,
+    "late payment fee": 10,
+    "confidentiality": 10,
+    "work for hire": 15
+}
+
+# Low Impact (5 pts) -> Annoyances
+LOW_RISKS = {
+    "written notice": 5,
+    "30 days": 5,
+    "reasonable efforts": 5
+}
+
+
+SCORED_TERMS = list(HIGH_RISKS) + list(MEDIUM_RISKS)
+# Overlap kept between pages so terms split across a page boundary still match
+TERM_OVERLAP = max(len(t) for t in SCORED_TERMS) - 1
+
+
+def find_risk_terms(text):
+    """
+    Returns the set of scored terms present in the text. Accepts a string or
+    an iterable of page strings (e.g. a TextSpool), scanned as if joined.
+    """
+    if isinstance(text, str):
+        text_lower = text.lower()
+        return {term for term in SCORED_TERMS if term in text_lower}
+
+    found = set()
+    tail = ""
+    for page in text:
+        window = tail + page.lower()
+        found.update(term for term in SCORED_TERMS if term in window)
+        tail = window[-TERM_OVERLAP:]
+    return found
+
+
+def document_head(text, limit):
+    """First `limit` characters of a string or TextSpool."""
+    if isinstance(text, str):
+        return text[:limit]
+    return text.head(limit)
+
+
 def calculate_risk_score(text):
     """
     Algorithmic Risk Scoring for Contracts.
     Scans for 20+ precise legal keywords and assigns weighted penalties.
+    Accepts a string or a page stream.
     """
     if not text:
         return {"score": 0, "level": "Low", "flags": []}
 
-    text_lower = text.lower()
+    found = find_risk_terms(text)
     score = 0
     flags = []
 
-    # Risk Categories & Weights
-    # High Impact (30 pts) -> Immediate Deal-Breakers
-    high_risks = {
-        "termination without cause": 30,
-        "termination for convenience": 30,
-        "indemnify": 25,
-        "indemnification": 25,
-        "unlimited liability": 30,
-        "liquidated damages": 25,
-        "automatic renewal": 25,
-        "auto-renewal": 25
-    }
-
-    # Medium Impact (15 pts) -> Standard but risky
-    medium_risks = {
-        "arbitration": 15,
-        "exclusive jurisdiction": 15,
-        "non-compete": 15,
-        "exclusivity": 15,
-        "penalty": 15,
-        "late payment fee": 10,
-        "confidentiality": 10,
-        "work for hire": 15
-    }
-
-    # Low Impact (5 pts) -> Annoyances
-    low_risks = {
-        "written notice": 5,
-        "30 days": 5,
-        "reasonable efforts": 5
-    }
-
     # 1. Scan High Risks
-    for term, points in high_risks.items():
-        if term in text_lower:
+    for term, points in HIGH_RISKS.items():
+        if term in found:
             score += points
             if term not in flags: flags.append(term.title())
 
     # 2. Scan Medium Risks
-    for term, points in medium_risks.items():
-        if term in text_lower:
+    for term, points in MEDIUM_RISKS.items():
+        if term in found:
             score += points
             # Only add to flags if we don't have too many already
             if term not in flags and len(flags) < 6: flags.append(term.title())
@@ -243,9 +367,11 @@ def calculate_risk_score(text):
     }
 
 
-def structured_prompt(text):
+# Characters of the document sent to the model
+PROMPT_TEXT_LIMIT = 15000
+
 
-    return f"""
+INSTRUCTION_PROMPT = """
     You are an Expert Senior Legal Consultant with 20+ years of experience in contract law.
     
     Your task is to analyze the following legal document and provide a crucial, risk-focused summary for a client who is NOT a lawyer.
@@ -284,7 +410,20 @@ def structured_prompt(text):
     - [Recommendation 1]
     - [Recommendation 2]
     
-    ---
+"""
+
+
+def document_prompt(text):
+    return f"""    ---
     **Document Text:**
-    {text[:15000]}
+    {document_head(text, PROMPT_TEXT_LIMIT)}
     """
+
+
+# User turn when instructions and document both come from the context cache
+CACHED_DOCUMENT_PROMPT = "Analyze the document provided above, following your instructions exactly."
+
+
+def structured_prompt(text):
+    """Full single-turn prompt: the fixed instructions followed by the document."""
+    return INSTRUCTION_PROMPT + document_prompt(text)
@@ -0,0 +1,74 @@
+import os
+import time
+
+# End-to-end time budget for one analysis request. Kept below Gunicorn's
+# worker timeout (120s in gunicorn.conf.py) so a slow request still gets a
+# rule-based answer instead of being killed mid-flight.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "100"))
+# Held back from the budget for the risk score + rule-based fallback
+FALLBACK_RESERVE_SECONDS = float(os.getenv("DEADLINE_FALLBACK_RESERVE_SECONDS", "2"))
+# Don't start a Gemini attempt / highlighting pass with less time than this
+MIN_AI_ATTEMPT_SECONDS = float(os.getenv("MIN_AI_ATTEMPT_SECONDS", "5"))
+MIN_HIGHLIGHT_SECONDS = float(os.getenv("MIN_HIGHLIGHT_SECONDS", "3"))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    Monotonic deadline passed down through extraction, highlighting and the
+    Gemini calls. Stages that run out of time record themselves in
+    cut_stages so the response can say what was skipped or truncated.
+    """
+
+    def __init__(self, seconds=REQUEST_DEADLINE_SECONDS, reserve=FALLBACK_RESERVE_SECONDS):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + max(seconds - reserve, 0)
+        self.cut_stages = []
+
+    def remaining(self):
+        """Seconds left for optional work (the fallback reserve excluded)."""
+        return max(self.expires_at - time.monotonic(), 0)
+
+    def allows(self, seconds):
+        return self.remaining() >= seconds
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cut(self, stage):
+        if stage not in self.cut_stages:
+            print(f"[WARNING] Deadline: '{stage}' cut short with {self.remaining():.1f}s left.")
+            self.cut_stages.append(stage)
+
+    def timeout_ms(self):
+        """Remaining budget as an HTTP timeout for the Gemini SDK."""
+        return max(int(self.remaining() * 1000), 1)
+
+    def report(self):
+        return {
+            "budget_seconds": self.seconds,
+            "elapsed_seconds": round(time.monotonic() - self.started_at, 2),
+            "cut_stages": list(self.cut_stages),
+            "degraded": bool(self.cut_stages)
+        }
+
+
+def deadline_from_request(request):
+    """
+    Builds the request's Deadline. Clients may ask for a shorter budget via
+    the X-Request-Deadline header or a 'deadline' form field (seconds); it
+    is capped at REQUEST_DEADLINE_SECONDS.
+    """
+    seconds = REQUEST_DEADLINE_SECONDS
+    requested = request.headers.get("X-Request-Deadline") or request.form.get("deadline")
+    if requested:
+        try:
+            if float(requested) > 0:
+                seconds = min(float(requested), REQUEST_DEADLINE_SECONDS)
+        except ValueError:
+            print(f"[WARNING] Ignoring invalid client deadline: {requested!r}")
+    return Deadline(seconds)
@@ -0,0 +1,250 @@
+import os
+import tempfile
+import threading
+import tracemalloc
+
+# Format libraries are imported on first use of that format, so startup
+# only pays for the ones a request actually needs.
+
+# Formats we can turn into plain text without the AI (images need Gemini OCR)
+TEXT_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+
+def extract_text(filepath, deadline=None):
+    """
+    Extracts plain text from a PDF, DOCX or TXT file.
+    Returns None for formats that have no local text extractor.
+    If the deadline runs out mid-PDF, the pages read so far (always at least
+    the first) are returned.
+    """
+    ext = filepath.lower()
+
+    # -------- PDF --------
+    if ext.endswith(".pdf"):
+        import pdfplumber
+
+        text = ""
+        with pdfplumber.open(filepath) as pdf:
+            for i, page in enumerate(pdf.pages):
+                if i and deadline and deadline.expired():
+                    deadline.cut("extraction")
+                    break
+                text += page.extract_text() or ""
+        return text
+
+    # -------- WORD DOC (DOCX) --------
+    if ext.endswith(".docx"):
+        from docx import Document
+
+        doc = Document(filepath)
+        return "\n".join([para.text for para in doc.paragraphs])
+
+    # -------- TEXT --------
+    if ext.endswith(".txt"):
+        with open(filepath, "r", encoding="utf-8") as f:
+            return f.read()
+
+    return None
+
+
+# ---------------- MEMORY-BOUNDED MODE ----------------
+# Enabled when a per-request budget is set. Pages are extracted one at a time,
+# their parse caches released immediately, and the text is kept in a spool
+# that moves to a temp file past SPILL_THRESHOLD_CHARS.
+MEMORY_BUDGET_MB = int(os.getenv("EXTRACTION_MEMORY_BUDGET_MB", "0"))
+SPILL_THRESHOLD_CHARS = int(os.getenv("EXTRACTION_SPILL_CHARS", "1000000"))
+
+TXT_BLOCK_CHARS = 64 * 1024
+DOCX_PARAGRAPHS_PER_PAGE = 200
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+class MemoryMonitorBusy(Exception):
+    pass
+
+
+def iter_pages(filepath, deadline=None):
+    """
+    Yields a document's text page by page (blocks for TXT, paragraph batches
+    for DOCX) without holding earlier pages in memory. Stops early, keeping
+    what was read (at least the first page), if the deadline runs out.
+    """
+    ext = filepath.lower()
+
+    if ext.endswith(".pdf"):
+        import pdfplumber
+
+        with pdfplumber.open(filepath) as pdf:
+            for i, page in enumerate(pdf.pages):
+                if i and deadline and deadline.expired():
+                    deadline.cut("extraction")
+                    return
+                try:
+                    yield page.extract_text() or ""
+                finally:
+                    # Drop the parsed layout objects pdfplumber caches per page
+                    release = getattr(page, "close", None) or page.flush_cache
+                    release()
+
+    elif ext.endswith(".docx"):
+        from docx import Document
+
+        batch = []
+        for para in Document(filepath).paragraphs:
+            batch.append(para.text)
+            if len(batch) >= DOCX_PARAGRAPHS_PER_PAGE:
+                yield "\n".join(batch) + "\n"
+                batch = []
+        if batch:
+            yield "\n".join(batch)
+
+    elif ext.endswith(".txt"):
+        with open(filepath, "r", encoding="utf-8") as f:
+            while True:
+                block = f.read(TXT_BLOCK_CHARS)
+                if not block:
+                    break
+                yield block
+
+
+class TextSpool:
+    """
+    Page-by-page text buffer that stays in memory up to spill_threshold
+    characters and then rolls over to a temporary file.
+
+    Iterating yields the pages back in order, so risk scoring, rule-based
+    analysis and the portfolio index can consume the stream instead of one
+    big string; head() gives the prefix used for the AI prompt.
+    """
+
+    def __init__(self, spill_threshold=SPILL_THRESHOLD_CHARS):
+        # newline="": page lengths must match what is read back, so "\r\n"
+        # may not be translated once the spool rolls over to a real file
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=spill_threshold, mode="w+",
+                                                     encoding="utf-8", newline="")
+        self._page_lengths = []
+        self._has_text = False
+        self.chars = 0
+
+    def write(self, page_text):
+        self._buffer.write(page_text)
+        self._page_lengths.append(len(page_text))
+        self.chars += len(page_text)
+        if not self._has_text and page_text.strip():
+            self._has_text = True
+
+    @property
+    def spilled(self):
+        return bool(getattr(self._buffer, "_rolled", False))
+
+    @property
+    def pages(self):
+        return len(self._page_lengths)
+
+    def __len__(self):
+        return self.chars
+
+    def is_blank(self):
+        return not self._has_text
+
+    def head(self, limit):
+        self._buffer.seek(0)
+        return self._buffer.read(limit)
+
+    def __iter__(self):
+        self._buffer.seek(0)
+        for length in self._page_lengths:
+            yield self._buffer.read(length)
+
+    def close(self):
+        self._buffer.close()
+
+
+class MemoryMonitor:
+    """
+    Tracks Python heap usage for one request with tracemalloc and enforces
+    the budget during extraction. tracemalloc measures the whole process, so
+    only one monitor may run per process at a time: a second concurrent
+    request (threaded server) gets MemoryMonitorBusy instead of being
+    charged for the other request's memory.
+    """
+
+    _active_lock = threading.Lock()
+
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.peak_bytes = 0
+        self._baseline = 0
+        self._owns_trace = False
+        self._active = False
+
+    def start(self):
+        if not MemoryMonitor._active_lock.acquire(blocking=False):
+            raise MemoryMonitorBusy("Another memory-bounded extraction is running in this worker.")
+        self._active = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_trace = True
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def check(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(self.peak_bytes, peak - self._baseline)
+        if self.budget_bytes and current - self._baseline > self.budget_bytes:
+            raise MemoryBudgetExceeded(
+                f"Extraction used {(current - self._baseline) / 1048576:.0f} MB, "
+                f"over the {self.budget_bytes // 1048576} MB budget."
+            )
+
+    def stop(self):
+        if not self._active:
+            return self.report()
+        try:
+            if tracemalloc.is_tracing():
+                self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1] - self._baseline)
+                if self._owns_trace:
+                    tracemalloc.stop()
+                    self._owns_trace = False
+        finally:
+            self._active = False
+            MemoryMonitor._active_lock.release()
+        return self.report()
+
+    def report(self):
+        return {
+            "peak_mb": round(self.peak_bytes / 1048576, 2),
+            "budget_mb": self.budget_bytes // 1048576
+        }
+
+
+def extract_pages(filepath, monitor=None, spill_threshold=SPILL_THRESHOLD_CHARS, deadline=None):
+    """
+    Memory-bounded counterpart of extract_text(): streams pages into a
+    TextSpool, checking the budget after each page. Returns None for formats
+    without a local text extractor.
+    """
+    if not filepath.lower().endswith(TEXT_EXTENSIONS):
+        return None
+
+    spool = TextSpool(spill_threshold)
+    try:
+        for page_text in iter_pages(filepath, deadline):
+            spool.write(page_text)
+            if monitor:
+                monitor.check()
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def is_blank(text):
+    """True if a string or TextSpool contains no readable text."""
+    if isinstance(text, str):
+        return len(text.strip()) == 0
+    return text.is_blank()
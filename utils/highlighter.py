@@ -1,11 +1,11 @@
-import fitz  # PyMuPDF
 import os
 
-def highlight_risky_clauses(pdf_path, risk_flags, output_filename=None):
+def highlight_risky_clauses(pdf_path, risk_flags, output_filename=None, deadline=None):
     """
     Opens a PDF, searches for the risk_flags (list of strings),
     and highlights them in RED.
     Saves the new PDF and returns the output path.
+    Gives up (returns None) if the request deadline runs out.
     """
     if not pdf_path or not os.path.exists(pdf_path):
         return None
@@ -14,10 +14,16 @@ def highlight_risky_clauses(pdf_path, risk_flags, output_filename=None):
         return None
 
     try:
+        import fitz  # PyMuPDF, imported lazily (only PDFs need it)
+
         doc = fitz.open(pdf_path)
         found_any = False
 
         for page in doc:
+            if deadline and deadline.expired():
+                deadline.cut("highlighting")
+                doc.close()
+                return None
             for term in risk_flags:
                 # Search for the term (case-insensitive)
                 # quads=True returns the coordinates of the text
@@ -0,0 +1,382 @@
+import os
+import re
+import json
+import time
+import heapq
+import bisect
+import hashlib
+import threading
+from operator import itemgetter
+from itertools import islice
+from datetime import date
+
+from .analyzer import find_risk_terms, SCORED_TERMS
+from .rule_based import extract_entities, iter_chunks
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still line-sized, just unlocked
+    fcntl = None
+
+# Opt-in: the portfolio index is only kept when a path is configured.
+# Only extracted metadata (flags, offsets, parties, dates, amounts) is stored,
+# never the document text itself.
+PORTFOLIO_INDEX_PATH = os.getenv("PORTFOLIO_INDEX_PATH")
+
+EMPTY = frozenset()
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11, "december": 12
+}
+
+
+def normalize_flag(flag):
+    return " ".join(flag.lower().split())
+
+
+def parse_date(raw):
+    """
+    Converts a date string found by extract_entities() into an ISO date.
+    Numeric dates are read as month/day/year. Returns None if unparseable.
+    """
+    raw = raw.strip()
+    try:
+        m = re.match(r'(\d{4})-(\d{2})-(\d{2})$', raw)
+        if m:
+            return date(int(m.group(1)), int(m.group(2)), int(m.group(3))).isoformat()
+
+        m = re.match(r'(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})$', raw)
+        if m:
+            year = int(m.group(3))
+            if year < 100:
+                year += 2000
+            return date(year, int(m.group(1)), int(m.group(2))).isoformat()
+
+        m = re.match(r'([A-Za-z]+)\s+(\d{1,2}),?\s+(\d{4})$', raw)
+        if m and m.group(1).lower() in MONTHS:
+            return date(int(m.group(3)), MONTHS[m.group(1).lower()], int(m.group(2))).isoformat()
+    except ValueError:
+        pass
+    return None
+
+
+def find_flag_offsets(text, flags, limit=50):
+    """
+    Character offsets of every (case-insensitive) occurrence of each flag.
+    Accepts a string or a page stream; offsets are into the joined text.
+    """
+    terms = list(dict.fromkeys(normalize_flag(f) for f in flags))
+    if not terms:
+        return {}
+    overlap = max(len(t) for t in terms) - 1
+    hits = {}
+    tail = ""
+    base = 0  # offset of the current window in the joined text
+    for chunk in iter_chunks(text):
+        window = tail + chunk.lower()
+        for term in terms:
+            offsets = hits.setdefault(term, [])
+            start = window.find(term)
+            while start != -1 and len(offsets) < limit:
+                # Matches wholly inside the carried-over tail were counted last page
+                if start + len(term) > len(tail):
+                    offsets.append(base + start)
+                start = window.find(term, start + 1)
+        tail = window[-overlap:] if overlap else ""
+        base += len(window) - len(tail)
+    return {term: offsets for term, offsets in hits.items() if offsets}
+
+
+def build_record(filename, text, risk_data):
+    """Builds the metadata record stored for one analyzed contract."""
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(text):
+        digest.update(chunk.encode("utf-8"))
+    entities = extract_entities(text)
+    # Every scored term found, not risk_data["flags"]: that list is capped
+    # for display and falls back to a "Standard Terms" placeholder
+    found = find_risk_terms(text)
+    flags = [term for term in SCORED_TERMS if term in found]
+    return {
+        "doc_id": digest.hexdigest(),
+        "filename": filename,
+        "analyzed_at": time.time(),
+        "score": risk_data.get("score", 0),
+        "level": risk_data.get("level", "Low"),
+        "flags": flags,
+        "hits": find_flag_offsets(text, flags),
+        "parties": [list(p) for p in entities["parties"]],
+        "dates": sorted({d for d in (parse_date(raw) for raw in entities["dates"]) if d}),
+        "amounts": entities["money"]
+    }
+
+
+class QueryError(ValueError):
+    pass
+
+
+class PortfolioIndex:
+    """
+    Append-only JSONL store of analysis records plus in-memory inverted indexes
+    (flag -> doc ids, party word -> doc ids, sorted dates, score order) for
+    fast lookups.
+
+    Every gunicorn worker keeps its own copy; refresh() tails the shared file
+    from the last offset read, so records written by other workers are
+    picked up incrementally before each query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.docs = {}
+        self.flag_postings = {}
+        self.party_postings = {}
+        self.date_entries = []  # sorted (iso_date, doc_id)
+        self.ranked = []        # sorted (-score, doc_id): highest risk first
+        self._offset = 0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    # ---------------- INDEXING ----------------
+    def _party_words(self, record):
+        words = set()
+        for party in record["parties"]:
+            for name in party:
+                words.update(re.findall(r'\w+', name.lower()))
+        return words
+
+    def _unindex(self, doc_id):
+        old = self.docs.pop(doc_id, None)
+        if not old:
+            return
+        for flag in old["flags"]:
+            self.flag_postings.get(flag, set()).discard(doc_id)
+        for word in self._party_words(old):
+            self.party_postings.get(word, set()).discard(doc_id)
+        self.date_entries = [e for e in self.date_entries if e[1] != doc_id]
+        self.ranked.remove((-old["score"], doc_id))
+
+    def _index(self, record, bulk=False):
+        doc_id = record["doc_id"]
+        if doc_id in self.docs:
+            self._unindex(doc_id)
+        # Unique, so each date is indexed once per document
+        record["dates"] = sorted(set(record["dates"]))
+        self.docs[doc_id] = record
+        for flag in record["flags"]:
+            self.flag_postings.setdefault(flag, set()).add(doc_id)
+        for word in self._party_words(record):
+            self.party_postings.setdefault(word, set()).add(doc_id)
+        for iso in record["dates"]:
+            if bulk:
+                self.date_entries.append((iso, doc_id))
+            else:
+                bisect.insort(self.date_entries, (iso, doc_id))
+        if bulk:
+            self.ranked.append((-record["score"], doc_id))
+        else:
+            bisect.insort(self.ranked, (-record["score"], doc_id))
+
+    def refresh(self):
+        """Loads any records appended to the store since the last read."""
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+            # Only consume complete lines; a concurrent writer may be mid-append
+            end = chunk.rfind(b"\n")
+            if end == -1:
+                return
+            self._offset += end + 1
+            lines = chunk[:end].decode("utf-8").split("\n")
+            bulk = len(lines) > 1
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    self._index(json.loads(line), bulk=bulk)
+                except (ValueError, KeyError) as e:
+                    print(f"[WARNING] Skipping corrupt portfolio record: {e}")
+            if bulk:
+                self.date_entries.sort()
+                self.ranked.sort()
+
+    def add(self, record):
+        """Persists a record and updates the in-memory index immediately."""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        # Pull in our own line (and anything other workers appended before it)
+        self.refresh()
+        return record["doc_id"]
+
+    # ---------------- QUERYING ----------------
+    def _tokenize(self, expr):
+        tokens = re.findall(r'\(|\)|"[^"]*"|[^\s()"]+', expr)
+        result = []
+        term = []
+        for tok in tokens:
+            if tok.upper() in ("AND", "OR", "NOT") or tok in ("(", ")"):
+                if term:
+                    result.append(("TERM", " ".join(term)))
+                    term = []
+                result.append((tok.upper(), tok))
+            elif tok.startswith('"'):
+                # Quoted flags always stand alone
+                if term:
+                    result.append(("TERM", " ".join(term)))
+                    term = []
+                result.append(("TERM", tok.strip('"')))
+            else:
+                term.append(tok.strip('"'))
+        if term:
+            result.append(("TERM", " ".join(term)))
+        return result
+
+    # Sub-expressions evaluate to (doc_ids, negated): a negated result means
+    # "every document except doc_ids", so NOT never copies the whole corpus.
+    @staticmethod
+    def _and(a, b):
+        (sa, na), (sb, nb) = a, b
+        if not na and not nb:
+            return sa & sb, False
+        if not na:
+            return sa - sb, False
+        if not nb:
+            return sb - sa, False
+        return sa | sb, True
+
+    @staticmethod
+    def _or(a, b):
+        (sa, na), (sb, nb) = a, b
+        if not na and not nb:
+            return sa | sb, False
+        if not na:
+            return sb - sa, True
+        if not nb:
+            return sa - sb, True
+        return sa & sb, True
+
+    def _parse(self, tokens, pos=0):
+        # expr := and_expr (OR and_expr)*
+        result, pos = self._parse_and(tokens, pos)
+        while pos < len(tokens) and tokens[pos][0] == "OR":
+            rhs, pos = self._parse_and(tokens, pos + 1)
+            result = self._or(result, rhs)
+        return result, pos
+
+    def _parse_and(self, tokens, pos):
+        result, pos = self._parse_not(tokens, pos)
+        while pos < len(tokens) and tokens[pos][0] in ("AND", "NOT", "TERM", "("):
+            if tokens[pos][0] == "AND":
+                pos += 1
+            rhs, pos = self._parse_not(tokens, pos)
+            result = self._and(result, rhs)
+        return result, pos
+
+    def _parse_not(self, tokens, pos):
+        if pos < len(tokens) and tokens[pos][0] == "NOT":
+            (operand, negated), pos = self._parse_not(tokens, pos + 1)
+            return (operand, not negated), pos
+        return self._parse_atom(tokens, pos)
+
+    def _parse_atom(self, tokens, pos):
+        if pos >= len(tokens):
+            raise QueryError("Unexpected end of query.")
+        kind, value = tokens[pos]
+        if kind == "(":
+            result, pos = self._parse(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos][0] != ")":
+                raise QueryError("Missing closing parenthesis.")
+            return result, pos + 1
+        if kind == "TERM":
+            # The postings set itself: query operators only ever build new sets
+            return (self.flag_postings.get(normalize_flag(value), EMPTY), False), pos + 1
+        raise QueryError(f"Unexpected '{value}' in query.")
+
+    def query(self, expr=None, date_from=None, date_to=None, party=None, limit=100):
+        """
+        Finds contracts matching a boolean flag expression, e.g.
+        'auto-renewal AND "unlimited liability" AND NOT arbitration',
+        optionally restricted to contracts mentioning a date in
+        [date_from, date_to] (ISO strings) and/or a party name.
+        Results are sorted by risk score, highest first.
+        """
+        if limit < 1:
+            raise QueryError("limit must be at least 1.")
+        self.refresh()
+        with self._lock:
+            if expr and expr.strip():
+                tokens = self._tokenize(expr)
+                (matches, negated), pos = self._parse(tokens)
+                if pos != len(tokens):
+                    raise QueryError(f"Unexpected '{tokens[pos][1]}' in query.")
+            else:
+                matches, negated = EMPTY, True  # Everything
+
+            # Date and party filters narrow to an explicit set (C-level set ops)
+            allowed = None
+            if date_from or date_to:
+                lo = bisect.bisect_left(self.date_entries, (date_from or "",))
+                hi = bisect.bisect_right(self.date_entries, (date_to or "9999-12-31", "\uffff"))
+                allowed = set(map(itemgetter(1), self.date_entries[lo:hi]))
+            words = re.findall(r'\w+', (party or "").lower())
+            if words:
+                party_sets = sorted((self.party_postings.get(word, EMPTY) for word in words), key=len)
+                named = party_sets[0].intersection(*party_sets[1:])
+                allowed = named if allowed is None else allowed & named
+
+            if allowed is not None:
+                matches, negated = (allowed - matches if negated else allowed & matches), False
+
+            total = len(self.docs) - len(matches) if negated else len(matches)
+            if negated or limit * len(self.docs) < total * total:
+                # Broad match: walk the score-ordered list until limit hits.
+                # Expected cost is about limit * len(docs) / total entries.
+                hits = (doc_id for _, doc_id in self.ranked if (doc_id in matches) != negated)
+                top = list(islice(hits, limit))
+            else:
+                # Narrow match: rank just the matches
+                top = [doc_id for _, doc_id in
+                       heapq.nsmallest(limit, ((-self.docs[d]["score"], d) for d in matches))]
+            return {"total": total, "results": [self.docs[doc_id] for doc_id in top]}
+
+
+_portfolio = None
+_portfolio_lock = threading.Lock()
+
+
+def get_portfolio():
+    """Returns the shared PortfolioIndex, or None when the feature is off."""
+    global _portfolio
+    if not PORTFOLIO_INDEX_PATH:
+        return None
+    with _portfolio_lock:
+        if _portfolio is None:
+            _portfolio = PortfolioIndex(PORTFOLIO_INDEX_PATH)
+        return _portfolio
+
+
+def record_analysis(filename, text, risk_data):
+    """Adds a finished analysis to the portfolio index if it is enabled."""
+    portfolio = get_portfolio()
+    if portfolio is None or not text or not risk_data:
+        return None
+    try:
+        return portfolio.add(build_record(filename, text, risk_data))
+    except Exception as e:
+        print(f"[WARNING] Could not update portfolio index: {e}")
+        return None
@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .deadline import MIN_AI_ATTEMPT_SECONDS
+
+# Gemini context caching: the fixed instruction block (and, for documents
+# analyzed repeatedly, the document itself) is uploaded once as cached
+# content and referenced by name, instead of being re-sent on every call.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() != "false"
+CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "3600"))
+# Recreate a little before the server-side expiry rather than racing it
+REFRESH_MARGIN_SECONDS = 60
+# After a model rejects caching (unsupported, content too small) don't ask again for a while
+UNSUPPORTED_RETRY_SECONDS = 3600
+# A document gets its own cache once it has been analyzed this many times
+DOCUMENT_CACHE_AFTER = 2
+# Gemini rejects caches below a per-model minimum (1024 tokens on current
+# Flash models), so don't spend a round trip on content we estimate smaller.
+# The instruction block alone is below it; instructions + document usually aren't.
+MIN_CACHE_TOKENS = int(os.getenv("GEMINI_MIN_CACHE_TOKENS", "1024"))
+CHARS_PER_TOKEN = 4
+MAX_TRACKED_DOCUMENTS = 1000
+
+TRANSIENT_ERRORS = ("429", "ResourceExhausted", "503", "ServiceUnavailable", "server_error",
+                    "504", "DEADLINE_EXCEEDED", "Timeout", "timed out")
+MISSING_CACHE_ERRORS = ("CachedContent not found", "cached content", "cachedContent", "expired")
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+
+def _big_enough(*parts):
+    return sum(len(part) for part in parts) // CHARS_PER_TOKEN >= MIN_CACHE_TOKENS
+
+
+class PromptCache:
+    """
+    Tracks cached-content handles per (API key, model, content), creating them
+    on demand, recreating them when their TTL runs out, and remembering which
+    models don't support caching so callers fall back to the plain prompt.
+    """
+
+    def __init__(self, ttl_seconds=CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}       # (key_id, model, content_id) -> (cache_name, refresh_at)
+        self._unsupported = {}   # (key_id, model, content_id or "*") -> retry_at
+        self._doc_counts = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "hits": 0, "recreated": 0, "unsupported": 0}
+
+    def note_document(self, document):
+        """Counts an analysis of this document; returns True once it's a repeat."""
+        doc_id = _digest(document)
+        with self._lock:
+            seen = self._doc_counts.pop(doc_id, 0) + 1
+            self._doc_counts[doc_id] = seen
+            while len(self._doc_counts) > MAX_TRACKED_DOCUMENTS:
+                self._doc_counts.popitem(last=False)
+        return seen >= DOCUMENT_CACHE_AFTER
+
+    def prepare(self, client, api_key, model, instructions, document, repeat=False, deadline=None):
+        """
+        Returns (cache_name, covers_document). cache_name is None when caching
+        isn't available, in which case the caller sends the full prompt.
+        When covers_document is True the cache already holds the document.
+        """
+        key_id = _digest(api_key or "")
+        doc_id = _digest(document)
+
+        # Repeat analyses: cache instructions + document together
+        if repeat and _big_enough(instructions, document):
+            name = self._get_or_create(client, key_id, model, "document", doc_id,
+                                       instructions, contents=[document], deadline=deadline)
+            if name:
+                return name, True
+
+        if not _big_enough(instructions):
+            return None, False
+        name = self._get_or_create(client, key_id, model, "instructions", _digest(instructions),
+                                   instructions, deadline=deadline)
+        return name, False
+
+    def invalidate(self, api_key, model, cache_name):
+        """Drops a handle the API no longer recognizes (expired or deleted)."""
+        key_id = _digest(api_key or "")
+        with self._lock:
+            for entry_key, (name, _) in list(self._entries.items()):
+                if entry_key[0] == key_id and entry_key[1] == model and name == cache_name:
+                    del self._entries[entry_key]
+            self.stats["recreated"] += 1
+
+    @staticmethod
+    def is_missing_cache_error(error):
+        error_str = str(error)
+        return ("404" in error_str or "NOT_FOUND" in error_str or "403" in error_str) and \
+            any(marker.lower() in error_str.lower() for marker in MISSING_CACHE_ERRORS)
+
+    def _get_or_create(self, client, key_id, model, kind, content_id, instructions, contents=None, deadline=None):
+        now = time.time()
+        entry_key = (key_id, model, content_id)
+
+        with self._lock:
+            if max(self._unsupported.get((key_id, model, "*"), 0),
+                   self._unsupported.get((key_id, model, content_id), 0)) > now:
+                return None
+            entry = self._entries.get(entry_key)
+            if entry and entry[1] > now:
+                self.stats["hits"] += 1
+                return entry[0]
+
+        # Creating a cache is an extra round trip; skip it when time is short
+        if deadline and not deadline.allows(2 * MIN_AI_ATTEMPT_SECONDS):
+            return None
+
+        # Imported lazily like the client itself
+        from google.genai import types
+
+        try:
+            cache = client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"contractclarity-{kind}",
+                    system_instruction=instructions,
+                    contents=contents,
+                    ttl=f"{self.ttl_seconds}s",
+                    http_options=types.HttpOptions(timeout=deadline.timeout_ms()) if deadline else None
+                )
+            )
+        except Exception as e:
+            error_str = str(e)
+            # Timeouts (ours or the server's) say nothing about cache support
+            if isinstance(e, TimeoutError) or (deadline and deadline.expired()) or \
+                    any(marker in error_str for marker in TRANSIENT_ERRORS):
+                print(f"[WARNING] Context cache unavailable for {model} (temporary): {e}")
+            else:
+                # Model doesn't support caching at all, or this content is below
+                # its minimum cacheable size (only this content is skipped then)
+                scope = "*" if "not supported" in error_str.lower() else content_id
+                print(f"[INFO] Context caching skipped for {model} ({kind}): {e}")
+                with self._lock:
+                    self._unsupported[(key_id, model, scope)] = now + UNSUPPORTED_RETRY_SECONDS
+                    self.stats["unsupported"] += 1
+            return None
+
+        with self._lock:
+            # Forget handles whose TTL has run out (the server has dropped them too)
+            for stale in [k for k, (_, refresh_at) in self._entries.items() if refresh_at <= now]:
+                del self._entries[stale]
+            self._entries[entry_key] = (cache.name, now + self.ttl_seconds - REFRESH_MARGIN_SECONDS)
+            self.stats["created"] += 1
+        print(f"[INFO] Created context cache {cache.name} for {model} ({kind})")
+        return cache.name
+
+
+prompt_cache = PromptCache()
@@ -1,30 +1,54 @@
 import re
 
-def rule_based_analysis(text):
-    # --- Dates ---
-    # Matches: Jan 1, 2024 | 2024-01-01 | 01/01/2024
-    date_patterns = [
-        r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}',
-        r'\b\d{4}-\d{2}-\d{2}\b',
-        r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'
-    ]
+# Compiled once at import (shared copy-on-write by preloaded gunicorn workers)
+# --- Dates ---
+# Matches: Jan 1, 2024 | 2024-01-01 | 01/01/2024
+DATE_PATTERNS = [
+    re.compile(r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}'),
+    re.compile(r'\b\d{4}-\d{2}-\d{2}\b'),
+    re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b')
+]
+
+# --- Money ---
+# Matches: $1,000 | €500 | 500 USD | 500 INR
+MONEY_PATTERNS = [
+    re.compile(r'[\$\€\£\₹]\s?\d+(?:,\d{3})*(?:\.\d{2})?'),
+    re.compile(r'\b\d+(?:,\d{3})*(?:\.\d{2})?\s+(?:USD|EUR|GBP|INR|CAD|AUD)\b')
+]
+
+# --- Parties ---
+# Naive attempt to find parties in "Between X and Y"
+PARTIES_PATTERN = re.compile(r'(?i)between\s+(.*?)\s+and\s+(.*?)(?:,|\s+defined|\s+herein)')
+
+# Split by sentence boundaries (roughly)
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?]) +')
+
+
+def iter_chunks(text):
+    """A string is one chunk; a page stream (e.g. TextSpool) is scanned page by page."""
+    if isinstance(text, str):
+        return [text]
+    return text
+
+
+def extract_entities(text):
+    """
+    Pulls the structured facts (dates, money, parties) out of a contract.
+    Shared by the rule-based report and the portfolio index.
+    Accepts a string or a page stream.
+    """
     dates = []
-    for p in date_patterns:
-        dates.extend(re.findall(p, text))
-
-    # --- Money ---
-    # Matches: $1,000 | €500 | 500 USD | 500 INR
-    money_patterns = [
-        r'[\$\€\£\₹]\s?\d+(?:,\d{3})*(?:\.\d{2})?',
-        r'\b\d+(?:,\d{3})*(?:\.\d{2})?\s+(?:USD|EUR|GBP|INR|CAD|AUD)\b'
-    ]
     money = []
-    for p in money_patterns:
-        money.extend(re.findall(p, text))
+    parties = []
+    for chunk in iter_chunks(text):
+        for p in DATE_PATTERNS:
+            dates.extend(p.findall(chunk))
+
+        for p in MONEY_PATTERNS:
+            money.extend(p.findall(chunk))
+
+        parties.extend(PARTIES_PATTERN.findall(chunk))
 
-    # --- Parties ---
-    # Naive attempt to find parties in "Between X and Y"
-    parties = re.findall(r'(?i)between\s+(.*?)\s+and\s+(.*?)(?:,|\s+defined|\s+herein)', text)
     extracted_parties = []
     if parties:
         for p in parties:
@@ -33,7 +57,20 @@ def rule_based_analysis(text):
             p1 = p1.strip()
             p2 = p2.strip()
             if len(p1) < 100 and len(p2) < 100: # Sanity check length
-                extracted_parties.append(f"{p1} & {p2}")
+                extracted_parties.append((p1, p2))
+
+    return {
+        "dates": list(dict.fromkeys(dates)),
+        "money": list(dict.fromkeys(money)),
+        "parties": extracted_parties
+    }
+
+
+def rule_based_analysis(text):
+    entities = extract_entities(text)
+    dates = entities["dates"]
+    money = entities["money"]
+    extracted_parties = [f"{p1} & {p2}" for p1, p2 in entities["parties"]]
 
     # --- Clauses & Risks ---
     obligations = []
@@ -42,8 +79,7 @@ def rule_based_analysis(text):
     confidentiality = []
     termination = []
 
-    # Split by sentence boundaries (roughly)
-    sentences = re.split(r'(?<=[.!?]) +', text)
+    sentences = (s for chunk in iter_chunks(text) for s in SENTENCE_SPLIT.split(chunk))
 
     for s in sentences:
         s_lower = s.lower()
@@ -70,8 +106,6 @@ def rule_based_analysis(text):
 
 
     # De-duplicate
-    dates = list(set(dates))
-    money = list(set(money))
     obligations = list(set(obligations))
     risks = list(set(risks))
     gov_law = list(set(gov_law))
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # No cross-worker coalescing on Windows; threads still coalesce
+    fcntl = None
+
+# Concurrent identical analyses (same document, mode, provider, model, key)
+# share one computation: across threads via an in-process table, and across
+# gunicorn workers via a lock file per key plus a short-lived result file.
+COALESCE_ENABLED = os.getenv("COALESCE_REQUESTS", "true").lower() != "false"
+COALESCE_DIR = os.getenv("COALESCE_DIR", os.path.join(tempfile.gettempdir(), "contractclarity-coalesce"))
+# How long a finished result file is kept for workers that queued behind it
+RESULT_TTL = float(os.getenv("COALESCE_RESULT_TTL", "10"))
+# Longest a duplicate waits for the in-flight computation before running its own
+WAIT_TIMEOUT = float(os.getenv("COALESCE_WAIT_SECONDS", "120"))
+POLL_INTERVAL = 0.1
+LOCK_FILE_TTL = 3600
+
+
+def file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def coalesce_key(doc_hash, mode, provider, model_name, api_key=None, confirm_fallback=False):
+    """
+    Key for a coalescable analysis. The API key is included (hashed) so one
+    user's request is never answered with a result paid for by another key.
+    """
+    parts = [doc_hash, mode or "", provider or "", model_name or "",
+             hashlib.sha256((api_key or "").encode("utf-8")).hexdigest(),
+             "fallback" if confirm_fallback else ""]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = True
+
+
+class SingleFlight:
+    def __init__(self, directory=COALESCE_DIR):
+        self.directory = directory
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"computed": 0, "coalesced_threads": 0, "coalesced_workers": 0}
+
+    # ---------------- PUBLIC ----------------
+    def do(self, key, fn, timeout=None, shareable=None):
+        """
+        Runs fn() once per key among concurrent callers and returns
+        (result, coalesced). fn's result must be JSON-serializable so it can
+        be handed to other workers. A caller that has waited `timeout`
+        seconds for someone else's computation runs fn() itself, as do
+        waiters whose leader's result fails shareable(result).
+        """
+        wait_timeout = WAIT_TIMEOUT if timeout is None else min(timeout, WAIT_TIMEOUT)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            # Another thread in this worker is already computing it
+            if not call.done.wait(wait_timeout):
+                print("[WARNING] Timed out waiting for a coalesced analysis; running it separately.")
+                self._count("computed")
+                return fn(), False
+            if call.error:
+                self._count("coalesced_threads")
+                raise call.error
+            if not call.shared:
+                self._count("computed")
+                return fn(), False
+            self._count("coalesced_threads")
+            return call.result, True
+
+        try:
+            call.result, coalesced = self._do_across_workers(key, fn, wait_timeout, shareable)
+            call.shared = coalesced or shareable is None or shareable(call.result)
+            return call.result, coalesced
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def snapshot(self):
+        """This worker's counters plus totals across all workers."""
+        with self._lock:
+            local = dict(self.stats)
+        return {"worker": local, "all_workers": self._read_shared_stats()}
+
+    # ---------------- CROSS-WORKER ----------------
+    def _do_across_workers(self, key, fn, wait_timeout, shareable=None):
+        if not fcntl:
+            self._count("computed")
+            return fn(), False
+
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+
+        with open(lock_path, "a") as lock_file:
+            waited_since = time.time()
+            acquired, waited = self._acquire(lock_file, wait_timeout)
+            try:
+                # Only reuse a result written by the worker we queued behind;
+                # an uncontended request always computes its own.
+                if acquired and waited:
+                    cached = self._read_result(result_path, waited_since)
+                    if cached is not None:
+                        self._count("coalesced_workers")
+                        return cached, True
+
+                self._count("computed")
+                result = fn()
+                if acquired and (shareable is None or shareable(result)):
+                    self._write_result(result_path, result)
+                return result, False
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._cleanup()
+
+    def _acquire(self, lock_file, wait_timeout):
+        """Returns (acquired, waited): waited is True if another worker held the lock."""
+        deadline = time.monotonic() + wait_timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, waited
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() >= deadline:
+                    print("[WARNING] Timed out waiting for a coalesced analysis; running it separately.")
+                    return False, waited
+                time.sleep(POLL_INTERVAL)
+
+    def _read_result(self, result_path, since):
+        try:
+            mtime = os.path.getmtime(result_path)
+            if mtime < since or time.time() - mtime > RESULT_TTL:
+                return None
+            with open(result_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, result_path, result):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, result_path)  # Atomic: readers never see half a file
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[WARNING] Could not share coalesced result: {e}")
+            return
+        # Result files hold analysis output: delete once the waiters have had it
+        timer = threading.Timer(RESULT_TTL, self._expire, args=(result_path,))
+        timer.daemon = True
+        timer.start()
+
+    def _expire(self, result_path):
+        try:
+            # Leave a newer result from a later computation alone
+            if time.time() - os.path.getmtime(result_path) >= RESULT_TTL:
+                os.remove(result_path)
+        except OSError:
+            pass
+
+    def _cleanup(self):
+        """
+        Deletes expired result files missed by their timer (e.g. the worker
+        exited first) and idle lock files.
+        """
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                age = now - os.path.getmtime(path)
+                if name.endswith(".json") and name != "stats.json" and age > RESULT_TTL:
+                    os.remove(path)
+                elif name.endswith(".lock") and age > LOCK_FILE_TTL:
+                    with open(path, "a") as f:
+                        # Only remove locks nobody holds
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.remove(path)
+            except OSError:
+                pass
+
+    # ---------------- STATS ----------------
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        if not fcntl:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, "stats.json"), os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, "r+b") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    shared = json.loads(f.read() or b"{}")
+                    shared[name] = shared.get(name, 0) + 1
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(shared).encode("utf-8"))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Could not update coalescing stats: {e}")
+
+    def _read_shared_stats(self):
+        totals = {name: 0 for name in self.stats}
+        try:
+            with open(os.path.join(self.directory, "stats.json"), "r", encoding="utf-8") as f:
+                totals.update(json.loads(f.read() or "{}"))
+        except (OSError, ValueError):
+            pass
+        totals["coalesced"] = totals["coalesced_threads"] + totals["coalesced_workers"]
+        return totals
+
+
+singleflight = SingleFlight()